@@ -104,14 +104,16 @@ class RandomFlip(BaseImageAugmentationLayer):
         }
 
     def _flip_image(image, transformation):
+        # `tf.reverse` dispatches straight to the vectorized `ReverseV2`
+        # kernel, skipping the rank checks done by `tf.image.flip_*`.
         flipped_output = tf.cond(
             transformation["flip_horizontal"],
-            lambda: tf.image.flip_left_right(image),
+            lambda: tf.reverse(image, axis=[W_AXIS]),
             lambda: image,
         )
         flipped_output = tf.cond(
             transformation["flip_vertical"],
-            lambda: tf.image.flip_up_down(flipped_output),
+            lambda: tf.reverse(flipped_output, axis=[H_AXIS]),
             lambda: flipped_output,
         )
         flipped_output.set_shape(image.shape)
@@ -22,18 +22,23 @@ from keras_cv.layers.preprocessing.random_flip import RandomFlip
 
 
 class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
-    def test_horizontal_flip(self):
+    @parameterized.named_parameters(
+        ("horizontal", "horizontal", (2,)),
+        ("vertical", "vertical", (1,)),
+        ("horizontal_and_vertical", "horizontal_and_vertical", (1, 2)),
+    )
+    def test_flip(self, mode, flip_axes):
         np.random.seed(1337)
-        mock_random = [0.6, 0.6]
+        mock_random = tf.constant(0.6)
         inp = np.random.random((2, 5, 8, 3))
-        expected_output = np.flip(inp, axis=2)
-        layer = RandomFlip("horizontal")
+        expected_output = np.flip(inp, axis=flip_axes)
+        layer = RandomFlip(mode)
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
-            actual_output = layer(inp, training=True)
+            actual_output = tf.function(layer)(inp, training=True)
             self.assertAllClose(expected_output, actual_output)
 
     def test_flip_ragged(self):
@@ -48,44 +53,15 @@ class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
         layer = RandomFlip(mode="horizontal", bounding_box_format="xywh")
         _ = layer(inputs)
 
-    def test_vertical_flip(self):
-        np.random.seed(1337)
-        mock_random = [0.6, 0.6]
-        inp = np.random.random((2, 5, 8, 3))
-        expected_output = np.flip(inp, axis=1)
-        layer = RandomFlip("vertical")
-        with unittest.mock.patch.object(
-            layer._random_generator,
-            "random_uniform",
-            side_effect=mock_random,
-        ):
-            actual_output = layer(inp, training=True)
-            self.assertAllClose(expected_output, actual_output)
-
-    def test_flip_both(self):
-        np.random.seed(1337)
-        mock_random = [0.6, 0.6, 0.6, 0.6]
-        inp = np.random.random((2, 5, 8, 3))
-        expected_output = np.flip(inp, axis=2)
-        expected_output = np.flip(expected_output, axis=1)
-        layer = RandomFlip("horizontal_and_vertical")
-        with unittest.mock.patch.object(
-            layer._random_generator,
-            "random_uniform",
-            side_effect=mock_random,
-        ):
-            actual_output = layer(inp, training=True)
-            self.assertAllClose(expected_output, actual_output)
-
     def test_random_flip_default(self):
         input_images = np.random.random((2, 5, 8, 3)).astype(np.float32)
         expected_output = np.flip(input_images, axis=2)
-        mock_random = [0.6, 0.6, 0.6, 0.6]
+        mock_random = tf.constant(0.6)
         layer = RandomFlip()
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
             actual_output = layer(input_images, training=True)
             self.assertAllClose(expected_output, actual_output)
@@ -99,12 +75,12 @@ class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
     def test_random_flip_unbatched_image(self):
         input_image = np.random.random((4, 4, 1)).astype(np.float32)
         expected_output = np.flip(input_image, axis=0)
-        mock_random = [0.6, 0.6, 0.6, 0.6]
+        mock_random = tf.constant(0.6)
         layer = RandomFlip("vertical")
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
             actual_output = layer(input_image, training=True)
             self.assertAllClose(expected_output, actual_output)
@@ -138,14 +114,14 @@ class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
         }
 
         input = {"images": [image, image], "bounding_boxes": bounding_boxes}
-        mock_random = [0.6, 0.6, 0.6, 0.6]
+        mock_random = tf.constant(0.6)
         layer = RandomFlip(
             "horizontal_and_vertical", bounding_box_format="xyxy"
         )
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
             output = layer(input, training=True)
 
@@ -187,14 +163,14 @@ class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
         }
 
         input = {"images": image, "bounding_boxes": bounding_boxes}
-        mock_random = [0.6, 0.6, 0.6, 0.6]
+        mock_random = tf.constant(0.6)
         layer = RandomFlip(
             "horizontal_and_vertical", bounding_box_format="xyxy"
         )
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
             output = layer(input, training=True)
 
@@ -225,13 +201,13 @@ class RandomFlipTest(tf.test.TestCase, parameterized.TestCase):
         input = {"images": image, "segmentation_masks": mask}
 
         # Flip both vertically and horizontally
-        mock_random = [0.6, 0.6]
+        mock_random = tf.constant(0.6)
         layer = RandomFlip("horizontal_and_vertical")
 
         with unittest.mock.patch.object(
             layer._random_generator,
             "random_uniform",
-            side_effect=mock_random,
+            return_value=mock_random,
         ):
             output = layer(input, training=True)
 
@@ -18,7 +18,6 @@ from tensorflow.keras import layers
 
 from keras_cv import bounding_box
 from keras_cv.layers.object_detection import box_matcher
-from keras_cv.utils import target_gather
 
 
 @keras.utils.register_keras_serializable(package="keras_cv")
@@ -78,9 +77,18 @@ class RetinaNetLabelEncoder(layers.Layer):
             force_match_for_each_col=False,
         )
         self.box_variance_tuple = box_variance
+        # Box targets are scaled by the reciprocal of the variance, which can
+        # be constant-folded into a multiply instead of a per-step divide.
+        self._box_variance_recip = tuple(1.0 / v for v in box_variance)
+        self._skip_convert = (
+            anchor_generator.bounding_box_format.lower()
+            == bounding_box_format.lower()
+        )
+        # Keyed by strings, as Keras can't checkpoint dicts with tuple keys.
+        self._anchor_cache = {}
         self.built = True
 
-    def _encode_sample(self, box_labels, anchor_boxes):
+    def _encode_sample(self, box_labels, anchors):
         """Creates box and classification targets for a batched sample
         Matches ground truth boxes to anchor boxes based on IOU.
         1. Calculates the pairwise IOU for the M `anchor_boxes` and N `gt_boxes`
@@ -92,87 +100,139 @@ class RetinaNetLabelEncoder(layers.Layer):
         4. The remaining anchor boxes that do not have any class assigned are
           ignored during training.
         Args:
-          gt_boxes: A float tensor with shape `(num_objects, 4)` representing
-            the ground truth boxes, where each box is of the format
+          box_labels: A dense KerasCV style bounding box dictionary. `"boxes"`
+            is a float tensor with shape `(batch_size, num_objects, 4)`
+            representing the ground truth boxes, where each box is of the
+            format `[x, y, width, height]`, padded with -1. `"classes"` is a
+            float tensor with shape `(batch_size, num_objects, 1)`
+            representing the ground truth classes.
+          anchors: A dict of anchor tensors for a given input image shape, as
+            returned by `_compute_anchors`. `anchors["boxes"]` is a float
+            tensor with the shape `(total_anchors, 4)` representing all the
+            anchor boxes, where each anchor box is of the format
             `[x, y, width, height]`.
-          gt_classes: A float Tensor with shape `(num_objects, 1)` representing
-            the ground truth classes.
-          anchor_boxes: A float tensor with the shape `(total_anchors, 4)`
-            representing all the anchor boxes for a given input image shape,
-            where each anchor box is of the format `[x, y, width, height]`.
         Returns:
-          matched_gt_idx: Index of the matched object
-          positive_mask: A mask for anchor boxes that have been assigned ground
-            truth boxes.
-          ignore_mask: A mask for anchor boxes that need to by ignored during
-            training
+          A dict with:
+          boxes: The encoded box targets, with shape
+            `(batch_size, total_anchors, 4)`.
+          classes: The class targets, with shape `(batch_size, total_anchors)`.
+            Anchors that are ignored or matched to the background are set to
+            `ignore_class` and `background_class` respectively.
+          matched_boxes: A boolean tensor with shape
+            `(batch_size, num_objects)` that is True for every ground truth box
+            that has the highest IoU for at least one anchor.
         """
         gt_boxes = box_labels["boxes"]
         gt_classes = box_labels["classes"]
-        iou_matrix = bounding_box.compute_iou(
-            anchor_boxes, gt_boxes, bounding_box_format="xywh"
+        anchor_boxes = anchors["boxes"]
+        box_shape = tf.shape(gt_boxes)
+        batch_size = box_shape[0]
+        n_boxes = box_shape[1]
+        # Images without any ground truth box get a single -1 padded box, so
+        # that the indices returned by the matcher (all 0 in that case) can
+        # always be gathered.
+        padding = [[0, 0], [0, tf.maximum(1 - n_boxes, 0)], [0, 0]]
+        gt_boxes = tf.pad(gt_boxes, padding, constant_values=-1)
+        gt_classes = tf.pad(gt_classes, padding, constant_values=-1)
+        # Boxes are matched by comparing IoUs against thresholds only, so the
+        # IoU matrix is kept in the compute dtype (e.g. `bfloat16` under a
+        # mixed precision policy). Box coordinates and deltas stay in float32.
+        iou_matrix = tf.cast(
+            self._compute_iou(anchors, gt_boxes), self.compute_dtype
+        )
+        # Ground truth boxes padded with -1 (e.g. by `bounding_box.to_dense`)
+        # are given an IoU of 0 so that no anchor can ever be matched to them.
+        # Otherwise an anchor in the corner of an image could match an all -1
+        # box outside the image, resulting in a NaN during training. The unit
+        # test passing all -1s to the label encoder covers this edge-case.
+        # The mask is only applied when some box is actually padded.
+        valid_gt = tf.reduce_any(gt_boxes != -1, axis=-1)
+        iou_matrix = tf.cond(
+            tf.reduce_all(valid_gt),
+            lambda: iou_matrix,
+            lambda: iou_matrix
+            * tf.cast(valid_gt[:, tf.newaxis, :], iou_matrix.dtype),
         )
         matched_gt_idx, matched_vals = self.box_matcher(iou_matrix)
         matched_vals = matched_vals[..., tf.newaxis]
-        positive_mask = tf.cast(tf.math.equal(matched_vals, 1), self.dtype)
-        ignore_mask = tf.cast(tf.math.equal(matched_vals, -2), self.dtype)
-        matched_gt_boxes = target_gather._target_gather(
-            gt_boxes, matched_gt_idx
-        )
+        matched_gt_boxes = tf.gather(gt_boxes, matched_gt_idx, batch_dims=1)
         box_target = bounding_box._encode_box_to_deltas(
             anchors=anchor_boxes,
             boxes=matched_gt_boxes,
             anchor_format=self.bounding_box_format,
             box_format=self.bounding_box_format,
-            variance=self.box_variance,
-        )
-        matched_gt_cls_ids = target_gather._target_gather(
-            gt_classes, matched_gt_idx
         )
+        box_target = box_target * self._box_variance_recip
+        matched_gt_cls_ids = tf.gather(gt_classes, matched_gt_idx, batch_dims=1)
         cls_target = tf.where(
-            tf.not_equal(positive_mask, 1.0),
-            self.background_class,
+            tf.equal(matched_vals, 1),
             matched_gt_cls_ids,
-        )
-        cls_target = tf.where(
-            tf.equal(ignore_mask, 1.0), self.ignore_class, cls_target
-        )
-        label = tf.concat([box_target, cls_target], axis=-1)
-
-        # In the case that a box in the corner of an image matches with an all
-        # -1 box that is outside the image, we should assign the box to the
-        # ignore class. There are rare cases where a -1 box can be matched,
-        # resulting in a NaN during training. The unit test passing all -1s to
-        # the label encoder ensures that we properly handle this edge-case.
-        label = tf.where(
-            tf.expand_dims(
-                tf.math.reduce_any(tf.math.is_nan(label), axis=-1), axis=-1
+            tf.where(
+                tf.equal(matched_vals, -2),
+                tf.cast(self.ignore_class, matched_gt_cls_ids.dtype),
+                tf.cast(self.background_class, matched_gt_cls_ids.dtype),
             ),
-            self.ignore_class,
-            label,
         )
+        result = {
+            "boxes": box_target,
+            "classes": tf.squeeze(cls_target, axis=-1),
+        }
 
-        result = {"boxes": label[:, :, :4], "classes": label[:, :, 4]}
-
-        box_shape = tf.shape(gt_boxes)
-        batch_size = box_shape[0]
-        n_boxes = box_shape[1]
-        box_ids = tf.range(n_boxes, dtype=matched_gt_idx.dtype)
-        matched_ids = tf.expand_dims(matched_gt_idx, axis=-1)
-        matches = box_ids == matched_ids
-        matches = tf.math.reduce_any(matches, axis=1)
-        self.matched_boxes_metric.update_state(
-            tf.zeros(
-                (
-                    batch_size,
-                    n_boxes,
-                ),
-                dtype=tf.int32,
-            ),
-            tf.cast(matches, tf.int32),
+        # Count the anchors matched to each ground truth box with a scatter,
+        # rather than materializing a (batch_size, n_anchors, n_boxes) mask.
+        # The extra column keeps the scatter in bounds for the padded box
+        # added when there are no ground truth boxes.
+        batch_ids = tf.broadcast_to(
+            tf.range(batch_size, dtype=matched_gt_idx.dtype)[:, tf.newaxis],
+            tf.shape(matched_gt_idx),
+        )
+        match_counts = tf.scatter_nd(
+            tf.stack([batch_ids, matched_gt_idx], axis=-1),
+            tf.ones_like(matched_gt_idx),
+            tf.stack([batch_size, n_boxes + 1]),
         )
+        result["matched_boxes"] = match_counts[:, :n_boxes] > 0
         return result
 
+    def _compute_iou(self, anchors, gt_boxes):
+        """Computes the pairwise IoU of `anchors` and `gt_boxes`.
+
+        Boxes are matched as `[x, y, width, height]`. Anchor corners are
+        precomputed as a `(4, total_anchors)` tensor along with their areas,
+        so only the ground truth boxes are converted per batch.
+        """
+        anchor_y_min, anchor_x_min, anchor_y_max, anchor_x_max = tf.unstack(
+            anchors["corners"][..., tf.newaxis]
+        )
+        gt_boxes = bounding_box.convert_format(
+            gt_boxes, source="xywh", target="yxyx"
+        )
+        gt_y_min, gt_x_min, gt_y_max, gt_x_max = tf.unstack(
+            gt_boxes[:, tf.newaxis, :, :], axis=-1
+        )
+        intersect_height = tf.maximum(
+            tf.minimum(anchor_y_max, gt_y_max)
+            - tf.maximum(anchor_y_min, gt_y_min),
+            0.0,
+        )
+        intersect_width = tf.maximum(
+            tf.minimum(anchor_x_max, gt_x_max)
+            - tf.maximum(anchor_x_min, gt_x_min),
+            0.0,
+        )
+        intersect_area = intersect_height * intersect_width
+        gt_areas = (gt_y_max - gt_y_min) * (gt_x_max - gt_x_min)
+        union_area = anchors["areas"][:, tf.newaxis] + gt_areas - intersect_area
+        return tf.math.divide_no_nan(intersect_area, union_area)
+
+    @tf.function(reduce_retracing=True)
+    def _encode_sample_graph(self, box_labels, anchors):
+        return self._encode_sample(box_labels, anchors)
+
+    @tf.function(jit_compile=True)
+    def _encode_sample_xla(self, box_labels, anchors):
+        return self._encode_sample(box_labels, anchors)
+
     def call(self, images, box_labels):
         """Creates box and classification targets for a batch
 
@@ -188,23 +248,84 @@ class RetinaNetLabelEncoder(layers.Layer):
                 f"Received `type(images)={type(images)}`."
             )
 
+        # XLA compiles one program per input shape. Eager labels always have a
+        # static shape, even when the number of boxes changes between batches,
+        # so only traced calls with statically shaped labels are compiled.
+        # Eager calls and ragged or dynamically shaped labels fall back to the
+        # non-jitted graph.
+        use_xla = (
+            not tf.executing_eagerly()
+            and not isinstance(box_labels["boxes"], tf.RaggedTensor)
+            and box_labels["boxes"].shape[1:].is_fully_defined()
+        )
+
         box_labels = bounding_box.to_dense(box_labels)
         if box_labels["classes"].get_shape().rank == 2:
             box_labels["classes"] = box_labels["classes"][..., tf.newaxis]
-        anchor_boxes = self.anchor_generator(image_shape=tf.shape(images[0]))
-        anchor_boxes = tf.concat(list(anchor_boxes.values()), axis=0)
-        anchor_boxes = bounding_box.convert_format(
-            anchor_boxes,
-            source=self.anchor_generator.bounding_box_format,
-            target=self.bounding_box_format,
-            images=images[0],
-        )
+        anchors = self._get_anchors(images)
+
+        if use_xla:
+            result = self._encode_sample_xla(box_labels, anchors)
+        else:
+            result = self._encode_sample_graph(box_labels, anchors)
 
-        result = self._encode_sample(box_labels, anchor_boxes)
+        # The metric is updated here rather than in `_encode_sample`, so that
+        # the compiled encoding functions stay free of variable updates.
+        matches = tf.cast(result["matched_boxes"], tf.int32)
+        self.matched_boxes_metric.update_state(tf.zeros_like(matches), matches)
         encoded_box_targets = result["boxes"]
         class_targets = result["classes"]
         return encoded_box_targets, class_targets
 
+    def _get_anchors(self, images):
+        """Returns the anchors for `images`, cached per image shape."""
+        image_shape = images.shape[1:]
+        if not image_shape.is_fully_defined():
+            image_shape = tf.get_static_value(tf.shape(images)[1:])
+            if image_shape is None:
+                return self._compute_anchors(tf.shape(images)[1:])
+
+        image_shape = tuple(int(dim) for dim in image_shape)
+        cache_key = "x".join(map(str, image_shape))
+        if cache_key not in self._anchor_cache:
+            # Anchors are built eagerly so that the cached tensors can be
+            # captured by any graph that later calls the encoder.
+            with tf.init_scope():
+                anchors = self._compute_anchors(image_shape)
+                self._anchor_cache[cache_key] = tf.nest.map_structure(
+                    tf.stop_gradient, anchors
+                )
+        return self._anchor_cache[cache_key]
+
+    def _compute_anchors(self, image_shape):
+        anchor_boxes = self.anchor_generator(image_shape=image_shape)
+        anchor_boxes = tf.concat(list(anchor_boxes.values()), axis=0)
+        if not self._skip_convert:
+            anchor_boxes = bounding_box.convert_format(
+                anchor_boxes,
+                source=self.anchor_generator.bounding_box_format,
+                target=self.bounding_box_format,
+                image_shape=image_shape,
+            )
+        # Anchors are matched as `[x, y, width, height]` boxes, see
+        # `_compute_iou`.
+        anchor_corners = tf.transpose(
+            bounding_box.convert_format(
+                anchor_boxes, source="xywh", target="yxyx"
+            )
+        )
+        anchor_y_min, anchor_x_min, anchor_y_max, anchor_x_max = tf.unstack(
+            anchor_corners
+        )
+        anchor_areas = (anchor_y_max - anchor_y_min) * (
+            anchor_x_max - anchor_x_min
+        )
+        return {
+            "boxes": anchor_boxes,
+            "corners": anchor_corners,
+            "areas": anchor_areas,
+        }
+
     def get_config(self):
         config = {
             "bounding_box_format": self.bounding_box_format,
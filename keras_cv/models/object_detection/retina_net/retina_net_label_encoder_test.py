@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 import tensorflow as tf
 
+from keras_cv import bounding_box
 from keras_cv import layers as cv_layers
 from keras_cv.models.object_detection.retina_net import RetinaNetLabelEncoder
 
@@ -124,3 +127,172 @@ class RetinaNetLabelEncoderTest(tf.test.TestCase):
         # 49104 is the anchor generator shape
         self.assertEqual(box_targets.shape, [2, 49104, 4])
         self.assertEqual(class_targets.shape, [2, 49104])
+
+        dense_box_targets, dense_class_targets = encoder(
+            images, bounding_box.to_dense(bounding_boxes)
+        )
+        self.assertAllClose(box_targets, dense_box_targets)
+        self.assertAllClose(class_targets, dense_class_targets)
+
+    def test_anchor_boxes_are_cached_per_image_shape(self):
+        boxes = tf.random.uniform(
+            shape=(2, 10, 4), minval=0.0, maxval=1.0, dtype=tf.float32
+        )
+        classes = tf.random.uniform(
+            shape=(2, 10), minval=0, maxval=5, dtype=tf.float32
+        )
+        strides = [2**i for i in range(3, 8)]
+        scales = [2**x for x in [0, 1 / 3, 2 / 3]]
+        sizes = [x**2 for x in [32.0, 64.0, 128.0, 256.0, 512.0]]
+        aspect_ratios = [0.5, 1.0, 2.0]
+
+        anchor_generator = cv_layers.AnchorGenerator(
+            bounding_box_format="xywh",
+            sizes=sizes,
+            aspect_ratios=aspect_ratios,
+            scales=scales,
+            strides=strides,
+        )
+        encoder = RetinaNetLabelEncoder(
+            anchor_generator=anchor_generator,
+            bounding_box_format="xywh",
+        )
+        bounding_boxes = {"boxes": boxes, "classes": classes}
+
+        eager_box_targets, eager_class_targets = encoder(
+            tf.random.uniform(shape=(2, 512, 512, 3)), bounding_boxes
+        )
+        graph_box_targets, graph_class_targets = tf.function(encoder)(
+            tf.random.uniform(shape=(2, 512, 512, 3)), bounding_boxes
+        )
+        self.assertEqual(len(encoder._anchor_cache), 1)
+        self.assertAllClose(eager_box_targets, graph_box_targets)
+        self.assertAllClose(eager_class_targets, graph_class_targets)
+
+        box_targets, _ = encoder(
+            tf.random.uniform(shape=(2, 256, 256, 3)), bounding_boxes
+        )
+        self.assertEqual(len(encoder._anchor_cache), 2)
+        self.assertEqual(box_targets.shape, [2, 12276, 4])
+
+        # The anchor cache must not interfere with checkpointing.
+        checkpoint = tf.train.Checkpoint(encoder=encoder)
+        checkpoint.save(os.path.join(self.get_temp_dir(), "encoder"))
+
+    def test_matched_boxes_metric(self):
+        images = tf.random.uniform(shape=(2, 512, 512, 3))
+        # The second image's second box is padding, and is never matched.
+        boxes = tf.constant(
+            [
+                [[0, 0, 100, 100], [300, 300, 100, 100]],
+                [[0, 0, 100, 100], [-1, -1, -1, -1]],
+            ],
+            dtype=tf.float32,
+        )
+        classes = tf.constant([[1, 2], [1, -1]], dtype=tf.float32)
+        strides = [2**i for i in range(3, 8)]
+        scales = [2**x for x in [0, 1 / 3, 2 / 3]]
+        sizes = [x**2 for x in [32.0, 64.0, 128.0, 256.0, 512.0]]
+        aspect_ratios = [0.5, 1.0, 2.0]
+
+        anchor_generator = cv_layers.AnchorGenerator(
+            bounding_box_format="xywh",
+            sizes=sizes,
+            aspect_ratios=aspect_ratios,
+            scales=scales,
+            strides=strides,
+        )
+        encoder = RetinaNetLabelEncoder(
+            anchor_generator=anchor_generator,
+            bounding_box_format="xywh",
+        )
+        bounding_boxes = {"boxes": boxes, "classes": classes}
+        _ = encoder(images, bounding_boxes)
+
+        # The metric compares the matches against all zeros, so it reports
+        # the fraction of boxes that no anchor was matched to: 1 of 4.
+        self.assertAllClose(encoder.matched_boxes_metric.result(), 0.25)
+
+    def test_encoding_without_boxes(self):
+        images = tf.random.uniform(shape=(1, 512, 512, 3))
+        boxes = tf.RaggedTensor.from_row_lengths(tf.zeros((0, 4)), [0])
+        classes = tf.RaggedTensor.from_row_lengths(tf.zeros((0,)), [0])
+        strides = [2**i for i in range(3, 8)]
+        scales = [2**x for x in [0, 1 / 3, 2 / 3]]
+        sizes = [x**2 for x in [32.0, 64.0, 128.0, 256.0, 512.0]]
+        aspect_ratios = [0.5, 1.0, 2.0]
+
+        anchor_generator = cv_layers.AnchorGenerator(
+            bounding_box_format="xywh",
+            sizes=sizes,
+            aspect_ratios=aspect_ratios,
+            scales=scales,
+            strides=strides,
+        )
+        encoder = RetinaNetLabelEncoder(
+            anchor_generator=anchor_generator,
+            bounding_box_format="xywh",
+        )
+
+        bounding_boxes = {"boxes": boxes, "classes": classes}
+        box_targets, class_targets = encoder(images, bounding_boxes)
+
+        self.assertEqual(box_targets.shape, [1, 49104, 4])
+        self.assertFalse(tf.math.reduce_any(tf.math.is_nan(box_targets)))
+        self.assertAllEqual(class_targets, -tf.ones((1, 49104)))
+        # There are no boxes to match, so the metric is never updated.
+        self.assertAllEqual(encoder.matched_boxes_metric.count, 0)
+
+    def test_xla_is_only_used_for_static_traced_labels(self):
+        images = tf.random.uniform(shape=(2, 512, 512, 3))
+        boxes = tf.random.uniform(
+            shape=(2, 10, 4), minval=0.0, maxval=1.0, dtype=tf.float32
+        )
+        classes = tf.random.uniform(
+            shape=(2, 10), minval=0, maxval=5, dtype=tf.float32
+        )
+        strides = [2**i for i in range(3, 8)]
+        scales = [2**x for x in [0, 1 / 3, 2 / 3]]
+        sizes = [x**2 for x in [32.0, 64.0, 128.0, 256.0, 512.0]]
+        aspect_ratios = [0.5, 1.0, 2.0]
+
+        anchor_generator = cv_layers.AnchorGenerator(
+            bounding_box_format="xywh",
+            sizes=sizes,
+            aspect_ratios=aspect_ratios,
+            scales=scales,
+            strides=strides,
+        )
+        encoder = RetinaNetLabelEncoder(
+            anchor_generator=anchor_generator,
+            bounding_box_format="xywh",
+        )
+        bounding_boxes = {"boxes": boxes, "classes": classes}
+
+        def tracing_counts():
+            return (
+                encoder._encode_sample_graph.experimental_get_tracing_count(),
+                encoder._encode_sample_xla.experimental_get_tracing_count(),
+            )
+
+        # Eager labels take the graph path, whatever their shape.
+        encoder(images, bounding_boxes)
+        self.assertEqual(tracing_counts(), (1, 0))
+
+        # Traced labels with a dynamic number of boxes take the graph path.
+        dynamic_encoder = tf.function(
+            encoder,
+            input_signature=[
+                tf.TensorSpec((2, 512, 512, 3)),
+                {
+                    "boxes": tf.TensorSpec((2, None, 4)),
+                    "classes": tf.TensorSpec((2, None)),
+                },
+            ],
+        )
+        dynamic_encoder(images, bounding_boxes)
+        self.assertEqual(tracing_counts(), (2, 0))
+
+        # Traced labels with a static shape are compiled with XLA.
+        tf.function(encoder)(images, bounding_boxes)
+        self.assertEqual(tracing_counts(), (2, 1))